@@ -106,6 +106,10 @@ SELECT add_compression_policy('vehicle_telemetry', INTERVAL '7 days', if_not_exi
 -- Continuous aggregate = materialized view tự động refresh
 -- Dashboard đọc từ view này thay vì query trực tiếp hypertable → nhanh hơn 10-100x
 -- Refresh policy: cập nhật data từ 3h trước đến 1h trước, mỗi giờ 1 lần
+-- Các cột *_points đếm vi phạm theo giờ (cùng ngưỡng với batch job) → batch job
+-- engine "sql" cộng dồn 24 bucket thay vì đếm lại toàn bộ raw data mỗi đêm.
+-- Quãng đường / thời gian lái cần LAG() (window function) nên không đưa vào đây được:
+-- continuous aggregate không hỗ trợ window function
 CREATE MATERIALIZED VIEW IF NOT EXISTS vehicle_speed_hourly
 WITH (timescaledb.continuous) AS
 SELECT
@@ -114,7 +118,10 @@ SELECT
     AVG(speed) AS avg_speed,
     MAX(speed) AS max_speed,
     MIN(speed) AS min_speed,
-    COUNT(*) AS total_points
+    COUNT(*) AS total_points,
+    COUNT(*) FILTER (WHERE speed > 80 AND speed <= 120) AS speeding_points,
+    COUNT(*) FILTER (WHERE speed > 120) AS critical_points,
+    COUNT(*) FILTER (WHERE engine_status IS NOT TRUE AND speed > 0) AS engine_off_moving_points
 FROM vehicle_telemetry
 GROUP BY vehicle_id, time_bucket('1 hour', ts)
 WITH NO DATA;
@@ -126,6 +133,45 @@ SELECT add_continuous_aggregate_policy('vehicle_speed_hourly',
     if_not_exists => TRUE
 );
 
+-- ============================================
+-- 7b. Segment GPS giữa 2 điểm liên tiếp (dist_prev + cờ gps_jump)
+-- ============================================
+-- Hàm thay vì VIEW: filter ts đặt NGOÀI view có LAG() không được push down
+-- (làm đổi kết quả window) → view sẽ tính LAG trên toàn bộ hypertable.
+-- Đặt filter ts bên trong hàm để chunk exclusion + idx_telemetry_vehicle_ts
+-- (vehicle_id, ts DESC — scan ngược được) vẫn dùng được.
+-- LANGUAGE sql + STABLE → planner inline như subquery, không có overhead gọi hàm.
+-- gps_jump: > 50km giữa 2 điểm liên tiếp = GPS nhảy, không cộng vào quãng đường.
+-- Chỉ gắn cờ chứ không lọc bỏ: điểm GPS nhảy vẫn có speed/engine hợp lệ, vẫn tính vào thống kê
+CREATE OR REPLACE FUNCTION vehicle_telemetry_segments(p_start TIMESTAMPTZ, p_end TIMESTAMPTZ)
+RETURNS TABLE (
+    vehicle_id    INTEGER,
+    ts            TIMESTAMPTZ,
+    speed         DOUBLE PRECISION,
+    engine_status BOOLEAN,
+    dist_prev     DOUBLE PRECISION,
+    gap_prev      DOUBLE PRECISION,
+    gps_jump      BOOLEAN
+)
+LANGUAGE sql STABLE AS $$
+    SELECT vehicle_id, ts, speed, engine_status, dist_prev, gap_prev,
+           dist_prev >= 50 AS gps_jump
+    FROM (
+        SELECT vehicle_id, ts, speed, engine_status,
+               -- Haversine; LEAST(1, ...) chặn sai số float làm asin() out of range
+               2 * 6371 * asin(LEAST(1, sqrt(
+                   sin(radians(latitude - LAG(latitude) OVER w) / 2) ^ 2
+                   + cos(radians(LAG(latitude) OVER w)) * cos(radians(latitude))
+                   * sin(radians(longitude - LAG(longitude) OVER w) / 2) ^ 2
+               ))) AS dist_prev,
+               EXTRACT(EPOCH FROM ts - LAG(ts) OVER w)::double precision AS gap_prev
+        FROM vehicle_telemetry
+        WHERE ts >= p_start
+          AND ts < p_end
+        WINDOW w AS (PARTITION BY vehicle_id ORDER BY ts)
+    ) s
+$$;
+
 -- ============================================
 -- 8. Bảng tổng hợp hàng ngày (target của Batch Job)
 -- ============================================
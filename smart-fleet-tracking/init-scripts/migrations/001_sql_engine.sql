@@ -0,0 +1,77 @@
+-- ============================================
+-- Migration 001 — schema cho daily_aggregation.py --engine sql
+-- ============================================
+-- init.sql chỉ chạy khi volume TimescaleDB còn trống, và
+-- CREATE MATERIALIZED VIEW IF NOT EXISTS bỏ qua view đã có → DB đã setup
+-- trước đó không có các cột *_points mới cũng như hàm vehicle_telemetry_segments().
+-- Chạy file này 1 lần trên DB cũ
+-- (file nằm trong thư mục con nên docker-entrypoint-initdb.d không tự chạy):
+--   docker exec -i fleet-timescaledb psql -U fleet_user -d fleet_tracking \
+--       < init-scripts/migrations/001_sql_engine.sql
+-- Không bọc trong transaction: CALL refresh_continuous_aggregate() phải chạy ngoài transaction block.
+
+-- ============================================
+-- 1. vehicle_speed_hourly + cột đếm vi phạm
+-- ============================================
+-- Continuous aggregate không ALTER thêm cột được → drop & tạo lại.
+-- DROP kéo theo refresh policy nên phải add lại policy.
+DROP MATERIALIZED VIEW IF EXISTS vehicle_speed_hourly;
+
+CREATE MATERIALIZED VIEW vehicle_speed_hourly
+WITH (timescaledb.continuous) AS
+SELECT
+    vehicle_id,
+    time_bucket('1 hour', ts) AS bucket,
+    AVG(speed) AS avg_speed,
+    MAX(speed) AS max_speed,
+    MIN(speed) AS min_speed,
+    COUNT(*) AS total_points,
+    COUNT(*) FILTER (WHERE speed > 80 AND speed <= 120) AS speeding_points,
+    COUNT(*) FILTER (WHERE speed > 120) AS critical_points,
+    COUNT(*) FILTER (WHERE engine_status IS NOT TRUE AND speed > 0) AS engine_off_moving_points
+FROM vehicle_telemetry
+GROUP BY vehicle_id, time_bucket('1 hour', ts)
+WITH NO DATA;
+
+SELECT add_continuous_aggregate_policy('vehicle_speed_hourly',
+    start_offset => INTERVAL '3 hours',
+    end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '1 hour',
+    if_not_exists => TRUE
+);
+
+-- Materialize lại toàn bộ lịch sử (view mới tạo WITH NO DATA)
+CALL refresh_continuous_aggregate('vehicle_speed_hourly', NULL, NULL);
+
+-- ============================================
+-- 2. vehicle_telemetry_segments() — xem giải thích ở init.sql mục 7b
+-- ============================================
+-- CREATE OR REPLACE: chạy lại nhiều lần không lỗi
+CREATE OR REPLACE FUNCTION vehicle_telemetry_segments(p_start TIMESTAMPTZ, p_end TIMESTAMPTZ)
+RETURNS TABLE (
+    vehicle_id    INTEGER,
+    ts            TIMESTAMPTZ,
+    speed         DOUBLE PRECISION,
+    engine_status BOOLEAN,
+    dist_prev     DOUBLE PRECISION,
+    gap_prev      DOUBLE PRECISION,
+    gps_jump      BOOLEAN
+)
+LANGUAGE sql STABLE AS $$
+    SELECT vehicle_id, ts, speed, engine_status, dist_prev, gap_prev,
+           dist_prev >= 50 AS gps_jump
+    FROM (
+        SELECT vehicle_id, ts, speed, engine_status,
+               -- Haversine; LEAST(1, ...) chặn sai số float làm asin() out of range
+               2 * 6371 * asin(LEAST(1, sqrt(
+                   sin(radians(latitude - LAG(latitude) OVER w) / 2) ^ 2
+                   + cos(radians(LAG(latitude) OVER w)) * cos(radians(latitude))
+                   * sin(radians(longitude - LAG(longitude) OVER w) / 2) ^ 2
+               ))) AS dist_prev,
+               EXTRACT(EPOCH FROM ts - LAG(ts) OVER w)::double precision AS gap_prev
+        FROM vehicle_telemetry
+        WHERE ts >= p_start
+          AND ts < p_end
+        WINDOW w AS (PARTITION BY vehicle_id ORDER BY ts)
+    ) s
+$$;
@@ -16,17 +16,24 @@ Thiết kế:
 Usage:
     python scripts/daily_aggregation.py                    # hôm qua
     python scripts/daily_aggregation.py --date 2026-02-17  # ngày cụ thể
+    python scripts/daily_aggregation.py --engine sql       # tính toàn bộ trong PostgreSQL
 """
 
 import os
+import io
+import csv
 import sys
 import math
 import argparse
 import logging
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from datetime import date, timedelta, datetime
-from typing import Optional
+from typing import Iterator, Optional
 
+import numpy as np
 import psycopg2
+from numba import njit
+from numba.types import Tuple, boolean, float32, float64, int64
 from psycopg2.extras import RealDictCursor
 
 logging.basicConfig(
@@ -45,111 +52,236 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASSWORD", "fleet_pass"),
 }
 
+# Số rows mỗi lần fetchmany từ server-side cursor — giới hạn memory phía client
+STREAM_ITERSIZE = 50000
+
+# Số xe tối đa chờ trong process pool / worker — giữ pool luôn có việc
+# mà không phải giữ mảng của cả fleet trong memory
+MAX_IN_FLIGHT_PER_WORKER = 2
+
+# Thứ tự cột khi COPY vào daily_vehicle_summary — khớp với key của compute_summary()
+SUMMARY_COLUMNS = (
+    "vehicle_id",
+    "summary_date",
+    "total_distance_km",
+    "avg_speed",
+    "max_speed",
+    "total_points",
+    "speeding_violations",
+    "critical_violations",
+    "engine_off_moving",
+    "total_driving_minutes",
+)
+
 
-def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+@njit(float64(float64, float64, float64, float64), cache=True, fastmath=True)
+def haversine_km(dlat: float, dlon: float, cos_lat1: float, cos_lat2: float) -> float:
     """
     Tính khoảng cách giữa 2 điểm GPS bằng công thức Haversine (đơn vị: km).
     Dùng Haversine thay vì Euclidean vì Trái Đất là hình cầu —
     Euclidean sai lệch lớn ở khoảng cách > 1km.
+    Nhận độ lệch lat/lon (radian) và cos(lat) đã tính sẵn: điểm i vừa là đầu
+    cạnh (i-1, i) vừa là đầu cạnh (i, i+1), tính cos 1 lần / điểm thay vì 2.
     """
     R = 6371.0  # Bán kính Trái Đất (km)
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
     a = (
         math.sin(dlat / 2) ** 2
-        + math.cos(math.radians(lat1))
-        * math.cos(math.radians(lat2))
+        + cos_lat1
+        * cos_lat2
         * math.sin(dlon / 2) ** 2
     )
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    # 2·asin(√a) ≡ 2·atan2(√a, √(1−a)) với a ∈ [0, 1], bớt 1 sqrt và rẻ hơn atan2;
+    # min() chặn sai số float đẩy √a > 1 làm asin() trả NaN
+    return R * 2 * math.asin(min(1.0, math.sqrt(a)))
 
 
-def fetch_daily_telemetry(conn, vehicle_id: int, target_date: date) -> list:
-    """Lấy tất cả GPS points của 1 xe trong 1 ngày, sắp theo thời gian."""
-    query = """
-        SELECT ts, latitude, longitude, speed, engine_status
-        FROM vehicle_telemetry
-        WHERE vehicle_id = %s
-          AND ts >= %s
-          AND ts < %s
-        ORDER BY ts ASC;
+# Signature cố định khớp dtype của telemetry_arrays(): Numba compile eager đúng
+# 1 bản native lúc import (worker fork từ process chính dùng lại luôn), không
+# dispatch theo kiểu lúc gọi. Mảng C-contiguous (::1) để compiler vectorize được.
+_SUMMARY_KERNEL_SIG = Tuple((float64, float64, float64, int64, int64, int64, float64))(
+    float64[::1], float64[::1], float32[::1], int64[::1], boolean[::1]
+)
+
+
+@njit(_SUMMARY_KERNEL_SIG, cache=True, fastmath=True, boundscheck=False)
+def _summary_kernel(lat, lon, speed, ts, engine):
     """
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(query, (vehicle_id, target_date, target_date + timedelta(days=1)))
-        return cur.fetchall()
-
-
-def compute_summary(vehicle_id: int, target_date: date, rows: list) -> dict:
-    """
-    Tổng hợp metrics từ dữ liệu GPS thô.
-    Chạy trên Python thay vì SQL window function vì:
-    - Haversine không có native function trong PostgreSQL
-    - Logic lọc GPS noise (>50km) cần xử lý tuần tự
-    """
-    if not rows:
-        return {
-            "vehicle_id": vehicle_id,
-            "summary_date": target_date,
-            "total_distance_km": 0,
-            "avg_speed": 0,
-            "max_speed": 0,
-            "total_points": 0,
-            "speeding_violations": 0,
-            "critical_violations": 0,
-            "engine_off_moving": 0,
-            "total_driving_minutes": 0,
-        }
+    Kernel Numba cho compute_summary(): 1 vòng lặp duy nhất trên các mảng
+    lat/lon (float64)/speed (float32)/ts (epoch ms, int64)/engine, compile ra native code nên không còn
+    overhead của interpreter. Trả về (total_distance, avg_speed, max_speed,
+    speeding, critical, engine_off_moving, driving_seconds).
+    """
+    # radians / cos(lat) của điểm trước được giữ lại cho cạnh kế tiếp
+    prev_lat_r = math.radians(lat[0])
+    prev_lon_r = math.radians(lon[0])
+    prev_cos_lat = math.cos(prev_lat_r)
 
     total_distance = 0.0
-    speeds = []
+    speed_sum = 0.0
+    speed_max = np.float64(speed[0])
     speeding = 0
     critical = 0
     engine_off_moving = 0
-    driving_seconds = 0.0
+    driving_ms = 0
 
-    for i, row in enumerate(rows):
-        speed = float(row["speed"])
-        speeds.append(speed)
-
-        # Tính khoảng cách giữa 2 điểm liên tiếp
-        if i > 0:
-            prev = rows[i - 1]
-            dist = haversine_km(
-                float(prev["latitude"]),
-                float(prev["longitude"]),
-                float(row["latitude"]),
-                float(row["longitude"]),
-            )
-            # Lọc GPS noise: >50km giữa 2 điểm liên tiếp = GPS jump, bỏ qua
-            if dist < 50:
-                total_distance += dist
+    for i in range(len(speed)):
+        s = np.float64(speed[i])
+        speed_sum += s
+        if s > speed_max:
+            speed_max = s
 
         # Đếm vi phạm tốc độ theo ngưỡng VN
-        if speed > 120:
+        if s > 120:
             critical += 1
-        elif speed > 80:
+        elif s > 80:
             speeding += 1
 
         # Engine tắt mà xe vẫn chạy: nghi ngờ kéo xe / trộm xe
-        if not row["engine_status"] and speed > 0:
+        if not engine[i] and s > 0:
             engine_off_moving += 1
 
-        # Ước lượng thời gian lái: engine ON + gap < 5 phút giữa 2 points
-        # Gap > 5 phút = xe dừng hoặc mất tín hiệu, không tính vào driving time
-        if i > 0 and row["engine_status"]:
-            prev_ts = rows[i - 1]["ts"]
-            curr_ts = row["ts"]
-            delta = (curr_ts - prev_ts).total_seconds()
-            if delta < 300:
-                driving_seconds += delta
+        if i > 0:
+            lat_r = math.radians(lat[i])
+            lon_r = math.radians(lon[i])
+            cos_lat = math.cos(lat_r)
+
+            # Lọc GPS noise: >50km giữa 2 điểm liên tiếp = GPS jump, bỏ qua
+            dist = haversine_km(lat_r - prev_lat_r, lon_r - prev_lon_r, prev_cos_lat, cos_lat)
+            if dist < 50:
+                total_distance += dist
+
+            prev_lat_r = lat_r
+            prev_lon_r = lon_r
+            prev_cos_lat = cos_lat
+
+            # Ước lượng thời gian lái: engine ON + gap < 5 phút giữa 2 points
+            # Gap > 5 phút = xe dừng hoặc mất tín hiệu, không tính vào driving time
+            if engine[i]:
+                delta = ts[i] - ts[i - 1]
+                if delta < 300_000:
+                    driving_ms += delta
+
+    return (
+        total_distance,
+        speed_sum / len(speed),
+        speed_max,
+        speeding,
+        critical,
+        engine_off_moving,
+        driving_ms / 1000,
+    )
+
+
+def stream_daily_telemetry(conn, vehicles: list, target_date: date) -> Iterator:
+    """
+    Lấy GPS points của tất cả xe trong 1 ngày bằng 1 query duy nhất,
+    yield (vehicle_id, arrays) theo thứ tự vehicle_id, arrays sắp theo thời gian
+    (xem telemetry_arrays()).
+    Dùng named cursor (server-side) để fetch từng batch STREAM_ITERSIZE rows và
+    chuyển ngay sang NumPy — tuple Python chỉ tồn tại trong 1 batch, mỗi xe chỉ
+    giữ mảng gọn tới khi được yield: 29 bytes/point (lat/lon float64 + speed float32
+    + ts int64 + engine bool). Số xe giữ đồng thời do MAX_IN_FLIGHT_PER_WORKER
+    giới hạn (xem aggregate_in_python()). 1 roundtrip thay vì N query/xe.
+    """
+    query = """
+        SELECT vehicle_id, (EXTRACT(EPOCH FROM ts) * 1000)::bigint AS ts_ms,
+               latitude, longitude, speed, engine_status
+        FROM vehicle_telemetry
+        WHERE ts >= %s
+          AND ts < %s
+          AND vehicle_id = ANY(%s::int[])
+        ORDER BY vehicle_id ASC, ts ASC;
+    """
+    current_vid = None
+    parts = []
+
+    # Tuple cursor thay vì RealDictCursor: không tạo 1 dict / row cho hàng triệu GPS points
+    with conn.cursor(name="telemetry_stream") as cur:
+        # psycopg2 adapt list → ARRAY[...]: 1 tham số thay vì IN (...) dài theo số xe
+        cur.execute(query, (target_date, target_date + timedelta(days=1), vehicles))
+        while True:
+            rows = cur.fetchmany(STREAM_ITERSIZE)
+            if not rows:
+                break
+
+            vids, *chunk = telemetry_arrays(rows)
+            # 1 batch có thể chứa đuôi của xe trước + đầu của xe sau: cắt tại chỗ vehicle_id đổi
+            bounds = [0, *(np.flatnonzero(np.diff(vids)) + 1), len(vids)]
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                vid = int(vids[start])
+                if vid != current_vid:
+                    if parts:
+                        yield current_vid, tuple(np.concatenate(cols) for cols in zip(*parts))
+                    current_vid, parts = vid, []
+                parts.append([col[start:end] for col in chunk])
+
+    if parts:
+        yield current_vid, tuple(np.concatenate(cols) for cols in zip(*parts))
+
+
+def telemetry_arrays(rows: list) -> tuple:
+    """
+    Chuyển rows tuple (vehicle_id, ts_ms, latitude, longitude, speed, engine_status)
+    của query telemetry thành các mảng NumPy (vehicle_id, lat, lon, speed, ts_ms, engine).
+    Phần sau vehicle_id là input của compute_summary() — dạng gọn để pickle
+    sang worker process.
+    ts lấy sẵn dạng epoch ms (int) từ PostgreSQL: không tạo datetime / timedelta
+    cho từng row, np.diff trên int64 cho ra gap chính xác tới ms.
+    """
+    vehicle_id, ts_ms, lat, lon, speed, engine = zip(*rows) if rows else ((),) * 6
+
+    # lat/lon giữ float64: 1 ULP float32 ở lon ≈ 106.7 là ~0.85 m — cỡ quãng đường
+    # xe chạy chậm đi trong 2s và thô hơn độ phân giải 1e-6° của GPS. Sai số làm tròn
+    # không triệt tiêu mà cộng dồn 1 chiều vào quãng đường (xe đứng yên + jitter
+    # có thể ra gấp đôi km), lệch khỏi engine "sql" vốn tính double.
+    # speed dùng float32 (nửa memory / pickle): chỉ có thể lật kết quả so ngưỡng
+    # 80/120 với giá trị nằm trong khoảng ~1e-5 quanh ngưỡng.
+    # Các accumulator trong kernel giữ float64 để cộng dồn không mất chính xác.
+    # engine_status NULL → False, giống bool(None)
+    return (
+        np.asarray(vehicle_id, dtype=np.int64),
+        np.asarray(lat, dtype=np.float64),
+        np.asarray(lon, dtype=np.float64),
+        np.asarray(speed, dtype=np.float32),
+        np.asarray(ts_ms, dtype=np.int64),
+        np.asarray(engine, dtype=bool),
+    )
+
+
+def compute_summary(vehicle_id: int, target_date: date, arrays: tuple) -> dict:
+    """
+    Tổng hợp metrics từ dữ liệu GPS thô (engine "python").
+    arrays = (lat, lon, speed, ts_ms, engine) từ stream_daily_telemetry(); chạy trong worker process
+    nên chỉ nhận dữ liệu đã pickle được, không đụng tới connection.
+    Giữ bản Python song song với aggregate_in_db() vì:
+    - Haversine không có native function trong PostgreSQL, bản SQL phải viết inline
+    - Dễ debug / thêm rule lọc GPS noise mới trước khi port sang SQL
+    """
+    lat, lon, speed, ts_ms, engine = arrays
+    n = len(speed)
+    # get_active_vehicles() lọc EXISTS + stream không yield xe rỗng → luôn có >= 1 point.
+    # Check tường minh thay vì assert (bị bỏ khi chạy python -O): kernel đọc
+    # lat[0]/speed[0] với boundscheck=False, mảng rỗng sẽ thành đọc ngoài vùng nhớ
+    if n == 0:
+        raise ValueError(f"vehicle {vehicle_id} has no telemetry for {target_date}")
+
+    (
+        total_distance,
+        avg_speed,
+        max_speed,
+        speeding,
+        critical,
+        engine_off_moving,
+        driving_seconds,
+    ) = _summary_kernel(lat, lon, speed, ts_ms, engine)
 
     return {
         "vehicle_id": vehicle_id,
         "summary_date": target_date,
         "total_distance_km": round(total_distance, 2),
-        "avg_speed": round(sum(speeds) / len(speeds), 2) if speeds else 0,
-        "max_speed": round(max(speeds), 2) if speeds else 0,
-        "total_points": len(rows),
+        "avg_speed": round(avg_speed, 2),
+        "max_speed": round(max_speed, 2),
+        "total_points": n,
         "speeding_violations": speeding,
         "critical_violations": critical,
         "engine_off_moving": engine_off_moving,
@@ -157,22 +289,170 @@ def compute_summary(vehicle_id: int, target_date: date, rows: list) -> dict:
     }
 
 
-def upsert_summary(conn, summary: dict):
+def upsert_summaries(conn, summaries: list):
     """
     Ghi kết quả vào bảng daily_vehicle_summary.
     Dùng ON CONFLICT DO UPDATE (Idempotent Upsert) để:
     - Chạy lại batch job không tạo duplicate
     - Fix bug rồi re-run mà không cần xóa data cũ
+    COPY cả fleet vào temp staging table (đường ingest nhanh nhất của PostgreSQL,
+    không parse SQL cho từng row) rồi upsert bằng 1 câu INSERT ... SELECT.
+    Staging table ON COMMIT DROP — không commit ở đây, run() commit 1 lần.
     """
+    columns = ", ".join(SUMMARY_COLUMNS)
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for summary in summaries:
+        writer.writerow(summary[col] for col in SUMMARY_COLUMNS)
+    buf.seek(0)
+
+    # CREATE TABLE AS thay vì LIKE: LIKE copy cả NOT NULL của cột id (SERIAL)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TEMP TABLE staging_summary ON COMMIT DROP AS
+            SELECT {columns} FROM daily_vehicle_summary
+            WITH NO DATA;
+        """)
+        cur.copy_expert(f"COPY staging_summary ({columns}) FROM STDIN WITH (FORMAT CSV)", buf)
+        cur.execute(f"""
+            INSERT INTO daily_vehicle_summary ({columns})
+            SELECT {columns} FROM staging_summary
+            ON CONFLICT (vehicle_id, summary_date) DO UPDATE SET
+                total_distance_km     = EXCLUDED.total_distance_km,
+                avg_speed             = EXCLUDED.avg_speed,
+                max_speed             = EXCLUDED.max_speed,
+                total_points          = EXCLUDED.total_points,
+                speeding_violations   = EXCLUDED.speeding_violations,
+                critical_violations   = EXCLUDED.critical_violations,
+                engine_off_moving     = EXCLUDED.engine_off_moving,
+                total_driving_minutes = EXCLUDED.total_driving_minutes,
+                created_at            = NOW();
+        """)
+
+
+def get_active_vehicles(conn, target_date: date) -> list:
+    """
+    Lấy danh sách xe active có GPS data trong ngày — chỉ chạy batch cho xe đang
+    hoạt động. Xe không có point nào bị bỏ qua luôn, không ghi summary toàn 0.
+    EXISTS dừng ở row đầu tiên tìm thấy qua idx_telemetry_vehicle_ts (vehicle_id, ts DESC).
+    """
+    query = """
+        SELECT v.id
+        FROM vehicles v
+        WHERE v.status = 'active'
+          AND EXISTS (
+              SELECT 1 FROM vehicle_telemetry t
+              WHERE t.vehicle_id = v.id
+                AND t.ts >= %s
+                AND t.ts < %s
+          )
+        ORDER BY v.id;
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(query, (target_date, target_date + timedelta(days=1)))
+        return [row["id"] for row in cur.fetchall()]
+
+
+def aggregate_in_python(conn, target_date: date) -> list:
+    """
+    Stream telemetry của cả fleet qua 1 query, tính summary từng xe song song
+    trên nhiều process rồi upsert 1 lần. Mỗi xe độc lập nên chia được theo xe.
+    Submit từng xe ngay khi stream xong và giới hạn số xe in-flight
+    (MAX_IN_FLIGHT_PER_WORKER × số worker): fetch và compute chạy chồng lên nhau,
+    memory phía client chỉ tỉ lệ với số xe đang chờ chứ không với cả fleet.
+    """
+    vehicles = get_active_vehicles(conn, target_date)
+    logger.info(f"Found {len(vehicles)} active vehicles with telemetry")
+    if not vehicles:
+        return []
+
+    max_workers = os.cpu_count() or 1
+    max_in_flight = MAX_IN_FLIGHT_PER_WORKER * max_workers
+    summaries = []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for vid, arrays in stream_daily_telemetry(conn, vehicles, target_date):
+            pending.add(executor.submit(compute_summary, vid, target_date, arrays))
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                summaries.extend(f.result() for f in done)
+
+        summaries.extend(f.result() for f in as_completed(pending))
+
+    # Future xong không theo thứ tự — sắp lại để log theo vehicle_id
+    summaries.sort(key=lambda s: s["vehicle_id"])
+    upsert_summaries(conn, summaries)
+    return summaries
+
+
+def refresh_hourly_stats(conn, target_date: date):
+    """
+    Refresh continuous aggregate vehicle_speed_hourly cho đúng ngày cần tính.
+    Policy chỉ refresh 3h gần nhất nên data đến trễ / chạy lại ngày cũ cần
+    refresh tay; TimescaleDB chỉ tính lại bucket có thay đổi (incremental).
+    CALL refresh_continuous_aggregate() không chạy được trong transaction
+    block → tạm bật autocommit.
+    """
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "CALL refresh_continuous_aggregate('vehicle_speed_hourly', %s::timestamptz, %s::timestamptz);",
+                (target_date, target_date + timedelta(days=1)),
+            )
+    finally:
+        conn.autocommit = False
+
+
+def aggregate_in_db(conn, target_date: date) -> list:
+    """
+    Engine "sql" — đẩy toàn bộ job xuống PostgreSQL bằng 1 câu INSERT ... SELECT.
+    Thống kê tốc độ / vi phạm cộng dồn từ 24 bucket của continuous aggregate
+    vehicle_speed_hourly (TimescaleDB duy trì incremental lúc refresh).
+    Quãng đường và thời gian lái cần điểm liền trước (LAG) nên vẫn scan raw data
+    qua vehicle_telemetry_segments() (init.sql) — Haversine + cờ gps_jump nằm sẵn
+    phía DB. Không có row GPS nào đi qua Python, chỉ RETURNING summary để log.
+    Chỉ ghi xe active có GPS data trong ngày (có bucket trong stats), giống engine "python".
+    """
+    refresh_hourly_stats(conn, target_date)
+
     query = """
+        WITH motion AS (
+            SELECT vehicle_id,
+                   SUM(dist_prev) FILTER (WHERE NOT gps_jump)                         AS total_distance_km,
+                   SUM(gap_prev) FILTER (WHERE engine_status AND gap_prev < 300) / 60 AS total_driving_minutes
+            FROM vehicle_telemetry_segments(%(start)s, %(end)s)
+            WHERE vehicle_id IN (SELECT id FROM vehicles WHERE status = 'active')
+            GROUP BY vehicle_id
+        ),
+        stats AS (
+            -- AVG theo ngày = trung bình có trọng số của AVG từng giờ
+            SELECT vehicle_id,
+                   SUM(avg_speed * total_points) / SUM(total_points) AS avg_speed,
+                   MAX(max_speed)                                    AS max_speed,
+                   SUM(total_points)                                 AS total_points,
+                   SUM(speeding_points)                              AS speeding_violations,
+                   SUM(critical_points)                              AS critical_violations,
+                   SUM(engine_off_moving_points)                     AS engine_off_moving
+            FROM vehicle_speed_hourly
+            WHERE bucket >= %(start)s
+              AND bucket < %(end)s
+            GROUP BY vehicle_id
+        )
         INSERT INTO daily_vehicle_summary
             (vehicle_id, summary_date, total_distance_km, avg_speed, max_speed,
              total_points, speeding_violations, critical_violations,
              engine_off_moving, total_driving_minutes)
-        VALUES
-            (%(vehicle_id)s, %(summary_date)s, %(total_distance_km)s, %(avg_speed)s,
-             %(max_speed)s, %(total_points)s, %(speeding_violations)s,
-             %(critical_violations)s, %(engine_off_moving)s, %(total_driving_minutes)s)
+        SELECT s.vehicle_id, %(summary_date)s,
+               COALESCE(m.total_distance_km, 0), s.avg_speed,
+               s.max_speed, s.total_points,
+               s.speeding_violations, s.critical_violations,
+               s.engine_off_moving, COALESCE(m.total_driving_minutes, 0)
+        FROM stats s
+        JOIN vehicles v ON v.id = s.vehicle_id AND v.status = 'active'
+        LEFT JOIN motion m ON m.vehicle_id = s.vehicle_id
         ON CONFLICT (vehicle_id, summary_date) DO UPDATE SET
             total_distance_km     = EXCLUDED.total_distance_km,
             avg_speed             = EXCLUDED.avg_speed,
@@ -182,44 +462,43 @@ def upsert_summary(conn, summary: dict):
             critical_violations   = EXCLUDED.critical_violations,
             engine_off_moving     = EXCLUDED.engine_off_moving,
             total_driving_minutes = EXCLUDED.total_driving_minutes,
-            created_at            = NOW();
+            created_at            = NOW()
+        RETURNING vehicle_id, total_points, total_distance_km, max_speed,
+                  speeding_violations, critical_violations;
     """
-    with conn.cursor() as cur:
-        cur.execute(query, summary)
-    conn.commit()
-
-
-def get_active_vehicles(conn) -> list:
-    """Lấy danh sách xe active — chỉ chạy batch cho xe đang hoạt động."""
+    params = {
+        "start": target_date,
+        "end": target_date + timedelta(days=1),
+        "summary_date": target_date,
+    }
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT id FROM vehicles WHERE status = 'active' ORDER BY id;")
-        return [row["id"] for row in cur.fetchall()]
+        cur.execute(query, params)
+        return sorted(cur.fetchall(), key=lambda r: r["vehicle_id"])
 
 
-def run(target_date: date):
-    """Entry point — xử lý tuần tự từng xe để kiểm soát memory."""
+def run(target_date: date, engine: str = "python"):
+    """Entry point — tổng hợp cả fleet bằng engine đã chọn, commit 1 lần."""
     logger.info(f"{'='*50}")
-    logger.info(f"Daily Aggregation Job — {target_date}")
+    logger.info(f"Daily Aggregation Job — {target_date} (engine: {engine})")
     logger.info(f"{'='*50}")
 
     conn = psycopg2.connect(**DB_CONFIG)
     try:
-        vehicles = get_active_vehicles(conn)
-        logger.info(f"Found {len(vehicles)} active vehicles")
+        if engine == "sql":
+            summaries = aggregate_in_db(conn, target_date)
+        else:
+            summaries = aggregate_in_python(conn, target_date)
+        conn.commit()
 
         total_points = 0
         total_violations = 0
 
-        for vid in vehicles:
-            rows = fetch_daily_telemetry(conn, vid, target_date)
-            summary = compute_summary(vid, target_date, rows)
-            upsert_summary(conn, summary)
-
+        for summary in summaries:
             total_points += summary["total_points"]
             total_violations += summary["speeding_violations"] + summary["critical_violations"]
 
             logger.info(
-                f"  Vehicle #{vid}: {summary['total_points']} points, "
+                f"  Vehicle #{summary['vehicle_id']}: {summary['total_points']} points, "
                 f"{summary['total_distance_km']} km, "
                 f"max {summary['max_speed']} km/h, "
                 f"{summary['speeding_violations']} speeding + "
@@ -227,7 +506,7 @@ def run(target_date: date):
             )
 
         logger.info(f"{'='*50}")
-        logger.info(f"DONE — {len(vehicles)} vehicles, {total_points} points, {total_violations} violations")
+        logger.info(f"DONE — {len(summaries)} vehicles, {total_points} points, {total_violations} violations")
         logger.info(f"{'='*50}")
 
     finally:
@@ -242,6 +521,12 @@ if __name__ == "__main__":
         default=None,
         help="Target date (YYYY-MM-DD). Default: yesterday",
     )
+    parser.add_argument(
+        "--engine",
+        choices=["python", "sql"],
+        default="python",
+        help="python: compute in Python (default); sql: compute entirely in PostgreSQL",
+    )
     args = parser.parse_args()
 
     if args.date:
@@ -249,4 +534,4 @@ if __name__ == "__main__":
     else:
         target = date.today() - timedelta(days=1)
 
-    run(target)
+    run(target, args.engine)